@@ -1,11 +1,22 @@
 import os
 import re
 import html
+import zlib
 import logging
+import hashlib
+import hmac
+import threading
+import orjson
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
+from flask_compress import Compress
+from werkzeug.exceptions import RequestEntityTooLarge
+from collections import OrderedDict
 from functools import wraps
-from bs4 import BeautifulSoup
-from inscriptis import get_text
+import lxml.html
+from lxml.cssselect import CSSSelector
+from lxml.etree import ParserError, XPath
+from inscriptis.html_engine import Inscriptis
 from inscriptis.model.config import ParserConfig
 
 # Configure logging to stdout
@@ -16,7 +27,25 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # orjson already produces UTF-8 bytes, skip the str round trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+Compress(app)
 
 # Load configuration from environment variables
 USERNAME = os.environ.get('BASIC_AUTH_USERNAME', 'admin')
@@ -25,6 +54,8 @@ HOST = os.environ.get('FLASK_HOST', '0.0.0.0')
 PORT = int(os.environ.get('FLASK_PORT', '5000'))
 DEBUG = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
 GIT_COMMIT = os.environ.get('GIT_COMMIT', 'unknown')
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', '1024'))
+MAX_DECOMPRESSED_SIZE = int(os.environ.get('MAX_DECOMPRESSED_SIZE', str(16 * 1024 * 1024)))
 
 # Selectors for OFD receipt content (priority order)
 OFD_CONTENT_SELECTORS = [
@@ -52,10 +83,71 @@ KEEP_URL_PATTERNS = [
     r'platformaofd\.ru/web/noauth/cheque/search',
 ]
 
+# Tags removed before text conversion
+UNWANTED_TAGS = ['script', 'style', 'meta', 'link', 'noscript', 'iframe', 'svg', 'img']
+
+# Promotional/advertising text fragments to strip from extracted text
+NOISE_PATTERNS = [
+    r'Вам подарки за проведенную оплату!?',
+    r'Вам доступен \(\d+\) подарок за покупку!?',
+    r'Подарок за оплату\s*',
+    r'Выбрать подарок\s*',
+    r'Забрать\s*',
+    r'Активировать\s*',
+    r'Ваш подарок за покупку неактивен\s*',
+    r'волна',  # decorative image alt text
+    r'Картинка',  # decorative image alt text
+    r'⭐️[^⭐]*⭐️',  # Emoji-wrapped promo text
+]
+
+# Precompiled regexes used on every request
+_URL_RE = re.compile(r'https?://[^\s<>"]+')
+_MULTI_NL = re.compile(r'\n{2,}')
+_MULTI_SP = re.compile(r' {2,}')
+# Runs of 3+ newlines, or trailing whitespace on a line
+_NORM_WS = re.compile(r'(?P<blank>\n{3,})|[^\S\n]+$', re.MULTILINE)
+_LINE_EDGE_WS = re.compile(r'^[^\S\n]+|[^\S\n]+$', re.MULTILINE)
+_TRACKING_RE = re.compile('|'.join(f'(?:{p})' for p in TRACKING_URL_PATTERNS))
+_KEEP_RE = re.compile('|'.join(f'(?:{p})' for p in KEEP_URL_PATTERNS))
+_NOISE_RE = re.compile('|'.join(f'(?:{p})' for p in NOISE_PATTERNS), re.IGNORECASE)
+
+# OFD container selectors compiled to XPath once
+_OFD_SELECTORS = [(sel, CSSSelector(sel, translator='html')) for sel in OFD_CONTENT_SELECTORS]
+
+# PDF link - prioritize receipt PDF over oferta
+_PDF_HREF_COND = (
+    "contains(@href, '/cheque/pdf')"
+    " and not(contains(translate(@href, 'OFERTA', 'oferta'), 'oferta'))"
+)
+_PDF_LINK_XPATH = XPath(f"//a[{_PDF_HREF_COND}]/@href")
+# OFD verification link with fn/fp/i parameters (not qrcode, not search - direct verification)
+_VERIFICATION_LINK_XPATH = XPath(
+    "//a[contains(@href, '/web/noauth/cheque')"
+    " and (contains(@href, 'fn=') or contains(@href, 'fp='))"
+    " and not(contains(@href, 'qrcode')) and not(contains(@href, 'search'))"
+    f" and not({_PDF_HREF_COND})]/@href"
+)
+
+# Shared inscriptis configuration (links and anchors are handled separately)
+_INSCRIPTIS_CFG = ParserConfig(display_links=False, display_anchors=False)
+
+
+# LRU cache of extraction results keyed by a hash of the request input
+_result_cache = OrderedDict()
+_result_cache_lock = threading.Lock()
+
+# Authorization headers that already passed the credential check
+AUTH_CACHE_SIZE = 128
+_auth_cache = set()
+_auth_cache_lock = threading.Lock()
+
 
 def check_auth(username, password):
     """Check if a username/password combination is valid."""
-    return username == USERNAME and password == PASSWORD
+    # Compare both fields in constant time; '&' avoids short-circuiting
+    username_ok = hmac.compare_digest((username or '').encode('utf-8'), USERNAME.encode('utf-8'))
+    password_ok = hmac.compare_digest((password or '').encode('utf-8'), PASSWORD.encode('utf-8'))
+    return username_ok & password_ok
 
 
 def authenticate():
@@ -69,53 +161,88 @@ def requires_auth(f):
     """Decorator to require basic authentication."""
     @wraps(f)
     def decorated(*args, **kwargs):
+        header = request.headers.get('Authorization', '')
+        if header and header in _auth_cache:
+            return f(*args, **kwargs)
         auth = request.authorization
         if not auth or not check_auth(auth.username, auth.password):
-            logger.warning(f"Authentication failed for {request.remote_addr}")
+            logger.warning("Authentication failed for %s", request.remote_addr)
             return authenticate()
+        with _auth_cache_lock:
+            if len(_auth_cache) >= AUTH_CACHE_SIZE:
+                _auth_cache.clear()
+            _auth_cache.add(header)
         return f(*args, **kwargs)
     return decorated
 
 
-def remove_advertising_blocks(soup):
+def parse_html(html_str):
+    """Parse an HTML string into an lxml document tree."""
+    # libxml2 stops at the first NUL character, drop them like HTML5 parsers do.
+    # Parsing UTF-8 bytes with an explicit encoding lets lxml accept inputs
+    # that start with an XML encoding declaration.
+    data = html_str.replace('\x00', '').encode('utf-8', 'surrogatepass')
+    try:
+        return lxml.html.document_fromstring(data, parser=lxml.html.HTMLParser(encoding='utf-8'))
+    except (ParserError, ValueError):
+        # Nothing left to parse (e.g. the input was only comments)
+        return lxml.html.document_fromstring('<html></html>')
+
+
+def remove_advertising_blocks(tree):
     """Remove advertising and promotional blocks by CSS selectors."""
     for selector in AD_SELECTORS:
-        for element in soup.select(selector):
-            element.decompose()
-    return soup
+        for element in tree.cssselect(selector):
+            element.drop_tree()
+    return tree
 
 
-def remove_unwanted_tags(soup):
+def remove_unwanted_tags(tree):
     """Remove script, style, and other unwanted tags."""
-    unwanted_tags = ['script', 'style', 'meta', 'link', 'noscript', 'iframe', 'svg', 'img']
-    for tag in unwanted_tags:
-        for element in soup.find_all(tag):
-            element.decompose()
-    return soup
+    # Materialize the matches first: dropping elements while iterating
+    # would invalidate the iterator.
+    for element in list(tree.iter(*UNWANTED_TAGS)):
+        if element.getparent() is not None:
+            element.drop_tree()
+    return tree
 
 
 def remove_html_comments(html_str):
     """Remove HTML comments."""
-    return re.sub(r'<!--.*?-->', '', html_str, flags=re.DOTALL)
+    parts = []
+    pos = 0
+    while True:
+        start = html_str.find('<!--', pos)
+        if start < 0:
+            break
+        end = html_str.find('-->', start + 4)
+        if end < 0:
+            # Unterminated comment is left as is
+            break
+        parts.append(html_str[pos:start])
+        pos = end + 3
+    parts.append(html_str[pos:])
+    return ''.join(parts)
 
 
 def filter_urls(text):
     """Remove tracking URLs but keep important ones (PDF, FNS)."""
+    # Most receipts contain no URLs at all
+    if 'http' not in text:
+        return text
+
     lines = text.split('\n')
     filtered_lines = []
 
     for line in lines:
         # Check if line contains a URL
-        url_match = re.search(r'https?://[^\s<>"]+', line)
+        url_match = _URL_RE.search(line)
         if url_match:
             url = url_match.group()
-            # Check if it's a tracking URL to remove
-            is_tracking = any(re.search(pattern, url) for pattern in TRACKING_URL_PATTERNS)
-            is_keep = any(re.search(pattern, url) for pattern in KEEP_URL_PATTERNS)
-
-            if is_tracking and not is_keep:
+            # Remove tracking URLs; the keep-list is only consulted for them
+            if _TRACKING_RE.search(url) and not _KEEP_RE.search(url):
                 # Remove the URL from the line
-                line = re.sub(r'https?://[^\s<>"]+', '', line)
+                line = _URL_RE.sub('', line)
 
         filtered_lines.append(line)
 
@@ -134,28 +261,31 @@ def make_absolute_url(href, base_url=''):
     return f"https://lk.platformaofd.ru{href}"
 
 
-def extract_important_links(soup, base_url=''):
+def extract_important_links(tree, base_url=''):
     """Extract important links (PDF, check verification) before processing."""
     links = {}
 
-    for a in soup.find_all('a', href=True):
-        href = a['href']
-        # PDF link - prioritize receipt PDF over oferta
-        if '/cheque/pdf' in href and 'oferta' not in href.lower():
-            links['pdf'] = make_absolute_url(href, base_url)
-        # OFD verification link with fn/fp/i parameters (not qrcode, not search - direct verification)
-        elif '/web/noauth/cheque' in href and ('fn=' in href or 'fp=' in href) and 'qrcode' not in href and 'search' not in href:
-            links['verification'] = make_absolute_url(href, base_url)
+    # The last matching link on the page wins
+    pdf_hrefs = _PDF_LINK_XPATH(tree)
+    if pdf_hrefs:
+        links['pdf'] = make_absolute_url(str(pdf_hrefs[-1]), base_url)
+
+    verification_hrefs = _VERIFICATION_LINK_XPATH(tree)
+    if verification_hrefs:
+        links['verification'] = make_absolute_url(str(verification_hrefs[-1]), base_url)
 
     return links
 
 
+def _normalize_whitespace_match(match):
+    return '\n\n' if match.group('blank') else ''
+
+
 def normalize_whitespace(text):
     """Normalize whitespace while preserving structure."""
-    # Remove excessive blank lines (more than 2 consecutive)
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    # Remove trailing whitespace on each line
-    text = '\n'.join(line.rstrip() for line in text.split('\n'))
+    # Remove excessive blank lines (more than 2 consecutive) and trailing
+    # whitespace on each line in a single pass
+    text = _NORM_WS.sub(_normalize_whitespace_match, text)
     # Remove leading/trailing whitespace
     text = text.strip()
     return text
@@ -164,64 +294,166 @@ def normalize_whitespace(text):
 def clean_extracted_text(text):
     """Additional cleaning of extracted text."""
     # Remove common noise patterns (promotional/advertising text)
-    noise_patterns = [
-        r'Вам подарки за проведенную оплату!?',
-        r'Вам доступен \(\d+\) подарок за покупку!?',
-        r'Подарок за оплату\s*',
-        r'Выбрать подарок\s*',
-        r'Забрать\s*',
-        r'Активировать\s*',
-        r'Ваш подарок за покупку неактивен\s*',
-        r'волна',  # decorative image alt text
-        r'Картинка',  # decorative image alt text
-        r'⭐️[^⭐]*⭐️',  # Emoji-wrapped promo text
-    ]
+    text = _NOISE_RE.sub('', text)
 
-    for pattern in noise_patterns:
-        text = re.sub(pattern, '', text, flags=re.IGNORECASE)
+    # Normalize whitespace: collapse multiple spaces
+    text = _MULTI_SP.sub(' ', text)
 
-    # Normalize whitespace: collapse multiple spaces/newlines
-    text = re.sub(r'\n{2,}', '\n', text)
-    text = re.sub(r' {2,}', ' ', text)
+    # Remove leading/trailing whitespace from each line, then drop the
+    # resulting empty lines by collapsing newline runs
+    text = _LINE_EDGE_WS.sub('', text)
+    text = _MULTI_NL.sub('\n', text)
 
-    # Remove leading/trailing whitespace from each line and filter empty
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
-
-    return '\n'.join(lines)
+    return text.strip('\n')
 
 
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint without authentication."""
-    logger.info(f"Health check from {request.remote_addr}")
+    logger.info("Health check from %s", request.remote_addr)
     return jsonify({'status': 'healthy'}), 200
 
 
-def extract_ofd_content(soup):
+def extract_ofd_content(tree):
     """Extract OFD receipt content from specific containers."""
     # Try to find OFD-specific content containers
-    for selector in OFD_CONTENT_SELECTORS:
-        container = soup.select_one(selector)
-        if container:
+    for selector, compiled in _OFD_SELECTORS:
+        matches = compiled(tree)
+        if matches:
+            container = matches[0]
             # For fido_cheque_container, content is HTML-encoded text
             if 'fido' in selector:
-                inner_html = container.get_text()
+                inner_html = container.text_content()
                 if inner_html and len(inner_html) > 100:
                     # Decode HTML entities and parse
                     decoded = html.unescape(inner_html)
-                    return BeautifulSoup(decoded, 'lxml')
+                    return parse_html(decoded)
             else:
+                # The container's tail is page text that follows it
+                container.tail = None
                 return container
     return None
 
 
+def decompress_body(body, encoding):
+    """Decompress a gzip/deflate request body, bounded by MAX_DECOMPRESSED_SIZE."""
+    wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+    decompressor = zlib.decompressobj(wbits)
+    # Allow one extra byte so that output left over means the limit was exceeded
+    data = decompressor.decompress(body, MAX_DECOMPRESSED_SIZE + 1)
+    if len(data) > MAX_DECOMPRESSED_SIZE or decompressor.unconsumed_tail:
+        raise RequestEntityTooLarge()
+    if not decompressor.eof:
+        raise zlib.error('Truncated compressed request body')
+    return data
+
+
+def get_request_json():
+    """Parse the JSON request body, decompressing gzip/deflate bodies.
+
+    Raises RequestEntityTooLarge if the decompressed body exceeds
+    MAX_DECOMPRESSED_SIZE.
+    """
+    encoding = request.headers.get('Content-Encoding', '').strip().lower()
+    if encoding not in ('gzip', 'deflate'):
+        return request.get_json(silent=True)
+    if not request.is_json:
+        return None
+    try:
+        body = decompress_body(request.get_data(), encoding)
+        return app.json.loads(body)
+    except (zlib.error, ValueError):
+        return None
+
+
+def cache_key(html_content, base_url):
+    """Build a compact cache key for an extraction request."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(html_content.encode('utf-8', 'surrogatepass'))
+    digest.update(b'\0')
+    digest.update(str(base_url).encode('utf-8', 'surrogatepass'))
+    return digest.digest()
+
+
+def get_cached_result(key):
+    """Return a cached extraction result, or None on a miss."""
+    with _result_cache_lock:
+        result = _result_cache.get(key)
+        if result is not None:
+            _result_cache.move_to_end(key)
+        return result
+
+
+def store_cached_result(key, result):
+    """Store an extraction result, evicting the least recently used one."""
+    if RESULT_CACHE_SIZE <= 0:
+        return
+    with _result_cache_lock:
+        _result_cache[key] = result
+        _result_cache.move_to_end(key)
+        while len(_result_cache) > RESULT_CACHE_SIZE:
+            _result_cache.popitem(last=False)
+
+
+def process_html(html_content, base_url=''):
+    """Run the extraction pipeline and return the text and important links."""
+    # Decode HTML entities in the input
+    html_content = html.unescape(html_content)
+
+    # Remove HTML comments first
+    html_content = remove_html_comments(html_content)
+
+    # Parse with lxml
+    tree = parse_html(html_content)
+
+    # Extract important links before removing elements
+    important_links = extract_important_links(tree, base_url)
+
+    # Try to extract OFD-specific content first
+    content_tree = extract_ofd_content(tree)
+
+    if content_tree is not None:
+        logger.info("Found OFD receipt container")
+        tree = content_tree
+
+    # Remove unwanted tags
+    tree = remove_unwanted_tags(tree)
+
+    # Use inscriptis to convert the cleaned tree to text with table structure.
+    # It also renders the root's tail, which extract_ofd_content clears.
+    text = Inscriptis(tree, _INSCRIPTIS_CFG).get_text()
+
+    # Filter out tracking URLs
+    text = filter_urls(text)
+
+    # Clean extracted text from noise
+    text = clean_extracted_text(text)
+
+    # Normalize whitespace
+    text = normalize_whitespace(text)
+
+    # Append important links at the end
+    if important_links:
+        text += '\n\n--- Ссылки ---'
+        if 'pdf' in important_links:
+            text += f'\nPDF чека: {important_links["pdf"]}'
+        if 'verification' in important_links:
+            text += f'\nПроверка чека: {important_links["verification"]}'
+
+    return text, important_links
+
+
 @app.route('/extract-text', methods=['POST'])
 @requires_auth
 def extract_text():
     """Extract main content text from HTML."""
     try:
         # Get JSON data from request
-        data = request.get_json(silent=True)
+        try:
+            data = get_request_json()
+        except RequestEntityTooLarge:
+            logger.error("Decompressed request body is too large")
+            return jsonify({'error': 'Request body is too large'}), 413
 
         if not data:
             logger.error("No JSON data provided")
@@ -237,61 +469,25 @@ def extract_text():
             logger.error("Invalid 'html' field")
             return jsonify({'error': "Invalid 'html' field"}), 400
 
-        logger.info(f"Processing HTML content from {request.remote_addr} (length: {len(html_content)})")
-
-        # Decode HTML entities in the input
-        html_content = html.unescape(html_content)
-
-        # Remove HTML comments first
-        html_content = remove_html_comments(html_content)
+        logger.info("Processing HTML content from %s (length: %d)", request.remote_addr, len(html_content))
 
         # Get optional URL for making relative links absolute
         base_url = data.get('url', '')
 
-        # Parse with BeautifulSoup
-        soup = BeautifulSoup(html_content, 'lxml')
-
-        # Extract important links before removing elements
-        important_links = extract_important_links(soup, base_url)
-
-        # Try to extract OFD-specific content first
-        content_soup = extract_ofd_content(soup)
-
-        if content_soup:
-            logger.info("Found OFD receipt container")
-            soup = content_soup
-
-        # Remove unwanted tags
-        soup = remove_unwanted_tags(soup)
-
-        # Get cleaned HTML
-        cleaned_html = str(soup)
-
-        # Use inscriptis to convert HTML to text with table structure
-        config = ParserConfig(display_links=False, display_anchors=False)
-        text = get_text(cleaned_html, config)
-
-        # Filter out tracking URLs
-        text = filter_urls(text)
-
-        # Clean extracted text from noise
-        text = clean_extracted_text(text)
-
-        # Normalize whitespace
-        text = normalize_whitespace(text)
-
-        # Append important links at the end
-        if important_links:
-            text += '\n\n--- Ссылки ---'
-            if 'pdf' in important_links:
-                text += f'\nPDF чека: {important_links["pdf"]}'
-            if 'verification' in important_links:
-                text += f'\nПроверка чека: {important_links["verification"]}'
+        # Identical inputs produce identical output, reuse it when possible
+        key = cache_key(html_content, base_url)
+        result = get_cached_result(key)
+        if result is not None:
+            logger.info("Returning cached result")
+        else:
+            result = process_html(html_content, base_url)
+            store_cached_result(key, result)
+        text, important_links = result
 
         # Calculate length
         text_length = len(text)
 
-        logger.info(f"Successfully extracted text (length: {text_length})")
+        logger.info("Successfully extracted text (length: %d)", text_length)
 
         return jsonify({
             'text': text,
@@ -300,10 +496,10 @@ def extract_text():
         }), 200
 
     except Exception as e:
-        logger.error(f"Error processing request: {str(e)}", exc_info=True)
+        logger.error("Error processing request: %s", e, exc_info=True)
         return jsonify({'error': f'Error processing request: {str(e)}'}), 500
 
 
 if __name__ == '__main__':
-    logger.info(f"Starting Flask application on {HOST}:{PORT} (debug={DEBUG}, commit={GIT_COMMIT})")
+    logger.info("Starting Flask application on %s:%d (debug=%s, commit=%s)", HOST, PORT, DEBUG, GIT_COMMIT)
     app.run(host=HOST, port=PORT, debug=DEBUG)
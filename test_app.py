@@ -126,6 +126,19 @@ def test_extract_text_no_json_data(client, auth_headers):
     assert 'error' in data
 
 
+def test_extract_text_invalid_json(client, auth_headers):
+    """Test that extract-text returns 400 for a malformed JSON body."""
+    response = client.post(
+        '/extract-text',
+        data='{"html": ',
+        content_type='application/json',
+        headers=auth_headers
+    )
+    assert response.status_code == 400
+    data = json.loads(response.data)
+    assert 'error' in data
+
+
 def test_extract_text_empty_html(client, auth_headers):
     """Test that extract-text returns 400 for empty html field."""
     response = client.post(
@@ -207,3 +220,294 @@ def test_complex_html_extraction(client, auth_headers):
     assert 'First paragraph' in data['text']
     assert 'analytics.js' not in data['text']
     assert 'margin:0' not in data['text']
+
+
+def test_tracking_urls_are_removed(client, auth_headers):
+    """Test that tracking URLs are stripped while important ones are kept."""
+    html_content = '''<html><body>
+        <p>Promo https://share.floctory.com/abc?x=1</p>
+        <p>Check https://www.nalog.gov.ru/rn77/</p>
+        <p>Other https://example.com/page</p>
+    </body></html>'''
+    response = client.post(
+        '/extract-text',
+        data=json.dumps({'html': html_content}),
+        content_type='application/json',
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert 'floctory' not in data['text']
+    assert 'https://www.nalog.gov.ru/rn77/' in data['text']
+    assert 'https://example.com/page' in data['text']
+
+
+def test_noise_patterns_are_removed(client, auth_headers):
+    """Test that promotional noise is removed from extracted text."""
+    html_content = '''<html><body>
+        <p>Итого: 100.00</p>
+        <p>Вам подарки за проведенную оплату!</p>
+        <p>Выбрать подарок</p>
+    </body></html>'''
+    response = client.post(
+        '/extract-text',
+        data=json.dumps({'html': html_content}),
+        content_type='application/json',
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert 'Итого: 100.00' in data['text']
+    assert 'подар' not in data['text'].lower()
+
+
+def test_ofd_encoded_container_extraction(client, auth_headers):
+    """Test that HTML-encoded receipt content is decoded and extracted."""
+    receipt = '<div><p>Кассовый чек</p><p>Молоко 89.99</p><p>ИТОГ 89.99</p></div>' * 3
+    html_content = (
+        '<html><body><nav>Меню сайта</nav>'
+        '<div id="fido_cheque_container">'
+        + receipt.replace('&', '&amp;').replace('<', '&amp;lt;').replace('>', '&amp;gt;')
+        + '</div></body></html>'
+    )
+    response = client.post(
+        '/extract-text',
+        data=json.dumps({'html': html_content}),
+        content_type='application/json',
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert 'Молоко 89.99' in data['text']
+    assert 'Меню сайта' not in data['text']
+    assert '<p>' not in data['text']
+
+
+def test_important_links_are_extracted(client, auth_headers):
+    """Test that receipt PDF and verification links are returned and made absolute."""
+    html_content = '''<html><body>
+        <p>Receipt</p>
+        <a href="/web/noauth/cheque/pdf/oferta">Оферта</a>
+        <a href="/web/noauth/cheque/pdf?fn=1&amp;fp=2">PDF</a>
+        <a href="/web/noauth/cheque/qrcode?fn=1">QR</a>
+        <a href="/web/noauth/cheque?fn=1&amp;fp=2&amp;i=3">Проверить</a>
+    </body></html>'''
+    response = client.post(
+        '/extract-text',
+        data=json.dumps({'html': html_content, 'url': 'https://lk.example.ru/page'}),
+        content_type='application/json',
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['links'] == {
+        'pdf': 'https://lk.example.ru/web/noauth/cheque/pdf?fn=1&fp=2',
+        'verification': 'https://lk.example.ru/web/noauth/cheque?fn=1&fp=2&i=3',
+    }
+    assert 'PDF чека: https://lk.example.ru/web/noauth/cheque/pdf?fn=1&fp=2' in data['text']
+
+
+def test_repeated_request_uses_cache(client, auth_headers, monkeypatch):
+    """Test that resubmitting the same HTML returns the cached result."""
+    import app as app_module
+    calls = []
+    original = app_module.process_html
+
+    def counting_process_html(*args, **kwargs):
+        calls.append(args)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(app_module, 'process_html', counting_process_html)
+    html_content = '<html><body><p>Cached receipt</p></body></html>'
+    responses = [
+        client.post(
+            '/extract-text',
+            data=json.dumps({'html': html_content}),
+            content_type='application/json',
+            headers=auth_headers
+        )
+        for _ in range(2)
+    ]
+    assert [r.status_code for r in responses] == [200, 200]
+    assert responses[0].data == responses[1].data
+    assert len(calls) == 1
+
+
+def test_extract_text_accepts_gzip_body(client, auth_headers):
+    """Test that a gzip-encoded request body is decompressed."""
+    import gzip
+    body = json.dumps({'html': '<html><body><p>Compressed content</p></body></html>'})
+    headers = dict(auth_headers, **{'Content-Encoding': 'gzip'})
+    response = client.post(
+        '/extract-text',
+        data=gzip.compress(body.encode('utf-8')),
+        content_type='application/json',
+        headers=headers
+    )
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert 'Compressed content' in data['text']
+
+
+def test_extract_text_invalid_gzip_body(client, auth_headers):
+    """Test that a body claiming gzip encoding but not compressed returns 400."""
+    headers = dict(auth_headers, **{'Content-Encoding': 'gzip'})
+    response = client.post(
+        '/extract-text',
+        data=json.dumps({'html': '<p>test</p>'}),
+        content_type='application/json',
+        headers=headers
+    )
+    assert response.status_code == 400
+
+
+def test_extract_text_compresses_response(client, auth_headers):
+    """Test that responses are gzip-compressed when the client accepts it."""
+    import gzip
+    html_content = '<html><body>' + '<p>Repeated receipt line</p>' * 100 + '</body></html>'
+    headers = dict(auth_headers, **{'Accept-Encoding': 'gzip'})
+    response = client.post(
+        '/extract-text',
+        data=json.dumps({'html': html_content}),
+        content_type='application/json',
+        headers=headers
+    )
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    data = json.loads(gzip.decompress(response.data))
+    assert 'Repeated receipt line' in data['text']
+
+
+def test_wrong_credentials_rejected_after_successful_login(client, auth_headers):
+    """Test that a cached successful login does not admit other credentials."""
+    payload = json.dumps({'html': '<html><body>test</body></html>'})
+    response = client.post(
+        '/extract-text',
+        data=payload,
+        content_type='application/json',
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+
+    credentials = base64.b64encode(b'admin:wrong').decode('utf-8')
+    response = client.post(
+        '/extract-text',
+        data=payload,
+        content_type='application/json',
+        headers={'Authorization': f'Basic {credentials}'}
+    )
+    assert response.status_code == 401
+
+
+def test_extract_text_with_xml_declaration(client, auth_headers):
+    """Test that input starting with an XML encoding declaration is parsed."""
+    html_content = '<?xml version="1.0" encoding="utf-8"?><html><body><p>Кассовый чек</p></body></html>'
+    response = client.post(
+        '/extract-text',
+        data=json.dumps({'html': html_content}),
+        content_type='application/json',
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['text'] == 'Кассовый чек'
+
+
+def test_extract_text_ignores_nul_characters(client, auth_headers):
+    """Test that a NUL character does not truncate the document."""
+    response = client.post(
+        '/extract-text',
+        data=json.dumps({'html': '<p>a</p>\x00<p>b</p>'}),
+        content_type='application/json',
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['text'] == 'a\nb'
+
+
+def test_text_after_ofd_container_is_excluded(client, auth_headers):
+    """Test that page text following the receipt container is not extracted."""
+    html_content = '<html><body><div class="check_ctn"><p>x</p></div>TAILTEXT</body></html>'
+    response = client.post(
+        '/extract-text',
+        data=json.dumps({'html': html_content}),
+        content_type='application/json',
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['text'] == 'x'
+
+
+def test_inline_markup_in_ofd_container_stays_on_one_line(client, auth_headers):
+    """Test that inline elements inside the receipt container are not split into lines."""
+    html_content = (
+        '<html><body><div class="check_ctn">'
+        '<div><span>ИТОГ</span> <span>89.99</span></div>'
+        '<div><b>ФН:</b> 123456</div>'
+        '<p>Итого<i>10</i> руб</p>'
+        '<ul><li>Молоко</li></ul>'
+        '</div></body></html>'
+    )
+    response = client.post(
+        '/extract-text',
+        data=json.dumps({'html': html_content}),
+        content_type='application/json',
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['text'] == 'ИТОГ 89.99\nФН: 123456\nИтого10 руб\n* Молоко'
+
+
+def test_extract_text_accepts_deflate_body(client, auth_headers):
+    """Test that a deflate-encoded request body is decompressed."""
+    import zlib
+    body = json.dumps({'html': '<html><body><p>Deflated content</p></body></html>'})
+    headers = dict(auth_headers, **{'Content-Encoding': 'deflate'})
+    response = client.post(
+        '/extract-text',
+        data=zlib.compress(body.encode('utf-8')),
+        content_type='application/json',
+        headers=headers
+    )
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert 'Deflated content' in data['text']
+
+
+def test_extract_text_rejects_oversized_decompressed_body(client, auth_headers):
+    """Test that a gzip body inflating past the size limit returns 413."""
+    import gzip
+    import app as app_module
+    body = b'{"html": "' + b' ' * (app_module.MAX_DECOMPRESSED_SIZE + 1) + b'"}'
+    headers = dict(auth_headers, **{'Content-Encoding': 'gzip'})
+    response = client.post(
+        '/extract-text',
+        data=gzip.compress(body),
+        content_type='application/json',
+        headers=headers
+    )
+    assert response.status_code == 413
+    data = json.loads(response.data)
+    assert 'error' in data
+
+
+def test_text_after_ofd_container_with_table_is_excluded(client, auth_headers):
+    """Test that inscriptis does not render the tail of a container with tables."""
+    html_content = (
+        '<html><body><div class="check_ctn">'
+        '<table><tr><td>a</td><td>b</td></tr></table>'
+        '</div>TAILTEXT after</body></html>'
+    )
+    response = client.post(
+        '/extract-text',
+        data=json.dumps({'html': html_content}),
+        content_type='application/json',
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert 'TAILTEXT' not in data['text']
+    assert data['text'] == 'a b'